@@ -1,24 +1,80 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from contextlib import asynccontextmanager
+import anyio
+import asyncio
+import json
+import time
 import logging
-from database import list_databases, get_table_names, get_columns
+import os
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import pyarrow as pa
+import semantic_cache
+from database import list_databases, get_table_names, get_columns, is_valid_identifier, ping_database
 from query_generator import (
     generate_sql_query,
+    generate_sql_queries,
+    stream_sql_query,
     validate_sql_query,
     suggest_index,
     execution_query,
     explain_query,
+    refresh_schema,
+    create_suggestion_token,
+    compute_suggestion,
+    get_suggestion,
+    supports_index_suggestions,
+    NOT_APPLICABLE_SUGGESTION,
+    DEFAULT_RESULT_LIMIT,
     SUPPORTED_PROVIDERS
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 
+# Handlers are sync and spend most of their time waiting on LLM and MySQL I/O,
+# so allow more of them in flight than AnyIO's default of 40 threads
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "100"))
+
+# Clients that send this Accept header get execute results as an Arrow IPC stream instead of JSON
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Upper bound on natural language queries accepted by /api/generate/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "20"))
+
+# Readiness is probed in the background so /api/ready never waits on external services
+READINESS_PROBE_INTERVAL_SECS = 60
+_readiness = {"database": False, "checked_at": None}
+
+async def _probe_readiness():
+    while True:
+        _readiness["database"] = await anyio.to_thread.run_sync(ping_database)
+        _readiness["checked_at"] = time.time()
+        await asyncio.sleep(READINESS_PROBE_INTERVAL_SECS)
+
+def _warm_up_semantic_cache():
+    """Preload the semantic cache; on failure requests fall back to normal generation."""
+    try:
+        semantic_cache.warm_up()
+    except Exception as e:
+        logger.warning(f"Semantic cache warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    await anyio.to_thread.run_sync(_warm_up_semantic_cache)
+    probe_task = asyncio.create_task(_probe_readiness())
+    yield
+    probe_task.cancel()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SQL Query Generator",
     description="Natural language to SQL converter with runtime provider selection",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware for frontend integration
@@ -31,32 +87,81 @@ app.add_middleware(
 )
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+logging.basicConfig(level=LOG_LEVEL)
+logging.getLogger().setLevel(LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+class _RecordQueueHandler(QueueHandler):
+    """Enqueue records as-is; the default prepare() clears record.args, which uvicorn's access formatter reads."""
+
+    def prepare(self, record):
+        return record
+
+def _queue_log_handlers(logger_names):
+    """Move each logger's handlers behind a QueueHandler so request threads never block on log I/O.
+
+    A QueueListener thread per logger feeds its original handlers.
+    """
+    for name in logger_names:
+        target = logging.getLogger(name)
+        handlers = [h for h in target.handlers if not isinstance(h, QueueHandler)]
+        if not handlers:
+            continue
+        log_queue = queue.SimpleQueue()
+        for handler in handlers:
+            target.removeHandler(handler)
+        target.addHandler(_RecordQueueHandler(log_queue))
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # Flush queued records on interpreter exit
+        atexit.register(listener.stop)
+
+# Root covers this app's modules; uvicorn's loggers don't propagate, so they are moved separately
+_queue_log_handlers(["", "uvicorn", "uvicorn.access"])
+
 # Pydantic models
 class LLMConfig(BaseModel):
     provider: str
     model: str
     api_key: str
+    # Draft model for speculative decoding (OpenAI-compatible providers that support it)
+    speculative_model: Optional[str] = None
 
 class QueryRequest(BaseModel):
     nl_query: str
     database: Optional[str] = None
     llm_config: Optional[LLMConfig] = None
 
+class BatchQueryRequest(BaseModel):
+    nl_queries: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+    database: Optional[str] = None
+    llm_config: Optional[LLMConfig] = None
+
 class SQLExecuteRequest(BaseModel):
     sql_query: str
     llm_config: Optional[LLMConfig] = None
+    limit: int = Field(DEFAULT_RESULT_LIMIT, ge=1, le=100000)
+    offset: int = Field(0, ge=0)
 
 class QueryResponse(BaseModel):
     sql_query: str
     explanation: Optional[str] = None
     
+class BatchQueryResult(BaseModel):
+    sql_query: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+
 class ExecutionResponse(BaseModel):
     results: List[Dict[str, Any]]
     row_count: int
-    optimization_suggestion: str
+    has_more: bool = False
+    optimization_suggestion: Optional[str] = None
+    suggestion_token: Optional[str] = None
+    sql_query: Optional[str] = None
 
 class ErrorResponse(BaseModel):
     error: str
@@ -69,6 +174,60 @@ def _llm_config_to_dict(llm_config: Optional[LLMConfig]) -> Optional[Dict[str, s
         return llm_config.model_dump()
     return llm_config.dict()
 
+def _wants_arrow(http_request: Request) -> bool:
+    return ARROW_STREAM_MEDIA_TYPE in http_request.headers.get("accept", "")
+
+def _build_execution_response(
+    result: Dict[str, Any],
+    sql_query: str,
+    llm_config: Optional[Dict[str, str]],
+    background_tasks: BackgroundTasks,
+    with_optimization: bool,
+    as_arrow: bool = False,
+    include_sql: bool = False
+):
+    """Build the execute response, scheduling index suggestions to run after it is sent.
+
+    Background suggestions need Redis so any worker can answer the token; without it no
+    token is issued and clients call POST /api/optimize with the SQL instead. Pass
+    include_sql=True to return SQL the client didn't send. Arrow responses carry the row
+    data in the body, sql_query in the schema metadata and the remaining fields as X- headers.
+    """
+    suggestion = None
+    suggestion_token = None
+    if with_optimization and not supports_index_suggestions(sql_query):
+        suggestion = NOT_APPLICABLE_SUGGESTION
+    elif with_optimization and llm_config is not None:
+        suggestion_token = create_suggestion_token()
+        if suggestion_token:
+            background_tasks.add_task(compute_suggestion, suggestion_token, sql_query, llm_config)
+
+    if as_arrow:
+        table = result["results"]
+        if include_sql:
+            table = table.replace_schema_metadata({"sql_query": sql_query})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        headers = {
+            "X-Row-Count": str(table.num_rows),
+            "X-Has-More": str(result["has_more"]).lower()
+        }
+        if suggestion:
+            headers["X-Optimization-Suggestion"] = suggestion
+        if suggestion_token:
+            headers["X-Suggestion-Token"] = suggestion_token
+        return Response(content=sink.getvalue().to_pybytes(), media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+
+    return ExecutionResponse(
+        results=result["results"],
+        row_count=len(result["results"]),
+        has_more=result["has_more"],
+        optimization_suggestion=suggestion,
+        suggestion_token=suggestion_token,
+        sql_query=sql_query if include_sql else None
+    )
+
 # Database endpoints
 @app.get("/api/databases")
 def api_list_databases():
@@ -84,6 +243,8 @@ def api_list_databases():
 def api_get_tables(database: str):
     """API endpoint to get table names in a specified database."""
     logger.debug(f"Fetching tables for database: {database}")
+    if not is_valid_identifier(database):
+        raise HTTPException(status_code=400, detail=f"Invalid database name: {database}")
     try:
         return get_table_names(database)
     except Exception as e:
@@ -94,12 +255,27 @@ def api_get_tables(database: str):
 def api_get_columns(table_name: str, database: Optional[str] = None): 
     """API endpoint to get columns in a specified table."""
     logger.debug(f"Fetching columns for table: {table_name} in database: {database}")
+    if not is_valid_identifier(table_name):
+        raise HTTPException(status_code=400, detail=f"Invalid table name: {table_name}")
+    if database is not None and not is_valid_identifier(database):
+        raise HTTPException(status_code=400, detail=f"Invalid database name: {database}")
     try:
         return get_columns(table_name, database)
     except Exception as e:
         logger.error(f"Error getting columns for table {table_name}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get columns: {str(e)}")
 
+@app.post("/api/schema/invalidate")
+def api_invalidate_schema():
+    """Clear the cached schema so the next query re-reads it from the database.
+
+    Without Redis only the worker handling this call is refreshed; the others pick up the
+    change when their schema TTL expires.
+    """
+    logger.debug("Invalidating schema cache.")
+    shared = refresh_schema()
+    return {"status": "ok", "scope": "all_workers" if shared else "this_worker"}
+
 # Query generation endpoints
 @app.post("/api/generate", response_model=QueryResponse)
 def generate_query(request: QueryRequest):
@@ -136,6 +312,57 @@ def generate_query(request: QueryRequest):
         logger.error(f"Error generating SQL query: {e}")
         raise HTTPException(status_code=500, detail=f"SQL generation failed: {str(e)}")
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/generate/stream")
+def generate_query_stream(request: QueryRequest):
+    """Stream SQL generation as server-sent events.
+
+    Emits "delta" events with {"text"} as tokens arrive, then a "done" event with the
+    cleaned {"sql_query"}, or an "error" event with {"detail"}.
+    """
+    logger.debug(f"Streaming SQL for: {request.nl_query}")
+
+    try:
+        events = stream_sql_query(request.nl_query, request.database, _llm_config_to_dict(request.llm_config))
+    except ValueError as e:
+        logger.error(f"LLM configuration error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def event_stream():
+        for event, value in events:
+            if event == "delta":
+                yield _sse_event(event, {"text": value})
+            elif event == "done":
+                yield _sse_event(event, {"sql_query": value})
+            else:
+                logger.error(f"Error streaming SQL query: {value}")
+                yield _sse_event(event, {"detail": value})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/generate/batch", response_model=BatchQueryResponse)
+def generate_queries_batch(request: BatchQueryRequest):
+    """Generate SQL for several natural language queries concurrently (no explanations)."""
+    logger.debug(f"Generating SQL for a batch of {len(request.nl_queries)} queries")
+
+    try:
+        llm_config = _llm_config_to_dict(request.llm_config)
+        results = generate_sql_queries(request.nl_queries, request.database, llm_config)
+        return BatchQueryResponse(results=[BatchQueryResult(**result) for result in results])
+
+    except ValueError as e:
+        logger.error(f"LLM configuration error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error generating SQL queries: {e}")
+        raise HTTPException(status_code=500, detail=f"SQL generation failed: {str(e)}")
+
 @app.post("/api/validate")
 def validate_query(request: SQLExecuteRequest):
     """Validate SQL query syntax."""
@@ -152,12 +379,28 @@ def validate_query(request: SQLExecuteRequest):
         raise HTTPException(status_code=500, detail=f"Validation failed: {str(e)}")
 
 @app.post("/api/execute", response_model=ExecutionResponse)
-def execute_query(request: SQLExecuteRequest):
-    """Execute the SQL query and return results with optimization suggestions."""
+def execute_query(
+    request: SQLExecuteRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    with_optimization: bool = True
+):
+    """Execute the SQL query and return results immediately.
+
+    Optimization suggestions are computed in the background; poll /api/optimize/{suggestion_token},
+    or call POST /api/optimize when no token was issued.
+    Pass with_optimization=false to skip them entirely. Send Accept: application/vnd.apache.arrow.stream
+    to receive the rows as Arrow IPC.
+    """
     logger.debug(f"Executing SQL query: {request.sql_query[:100]}...")
     
     try:
-        result = execution_query(request.sql_query, _llm_config_to_dict(request.llm_config))
+        llm_config = _llm_config_to_dict(request.llm_config)
+        as_arrow = _wants_arrow(http_request)
+        result = execution_query(
+            request.sql_query, llm_config, with_optimization=False,
+            limit=request.limit, offset=request.offset, as_arrow=as_arrow
+        )
         
         if result is None:
             raise HTTPException(
@@ -165,21 +408,8 @@ def execute_query(request: SQLExecuteRequest):
                 detail="Failed to execute SQL query. Please check the query syntax and database connection."
             )
         
-        # Ensure proper JSON serialization
-        serialized_results = []
-        for row in result["results"]:
-            if hasattr(row, '_mapping'):
-                serialized_results.append(dict(row._mapping))
-            elif hasattr(row, '_asdict'):
-                serialized_results.append(row._asdict())
-            else:
-                # Handle different SQLAlchemy result types
-                serialized_results.append(dict(row))
-        
-        return ExecutionResponse(
-            results=serialized_results,
-            row_count=len(serialized_results),
-            optimization_suggestion=result["optimization_suggestion"]
+        return _build_execution_response(
+            result, request.sql_query, llm_config, background_tasks, with_optimization, as_arrow
         )
     
     except ValueError as e:
@@ -195,8 +425,16 @@ def execute_query(request: SQLExecuteRequest):
         raise HTTPException(status_code=500, detail=f"Query execution failed: {str(e)}")
 
 @app.post("/api/generate-and-execute", response_model=ExecutionResponse)
-def generate_and_execute(request: QueryRequest):
-    """Generate SQL from natural language and execute it in one step."""
+def generate_and_execute(
+    request: QueryRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    with_optimization: bool = True
+):
+    """Generate SQL from natural language and execute it in one step.
+
+    Optimization suggestions and Arrow responses work the same way as /api/execute.
+    """
     logger.debug(f"Generate and execute for: {request.nl_query}")
     
     try:
@@ -210,7 +448,8 @@ def generate_and_execute(request: QueryRequest):
             )
         
         # Execute the generated query
-        result = execution_query(sql_query, llm_config)
+        as_arrow = _wants_arrow(http_request)
+        result = execution_query(sql_query, llm_config, with_optimization=False, as_arrow=as_arrow)
         
         if result is None:
             raise HTTPException(
@@ -218,20 +457,8 @@ def generate_and_execute(request: QueryRequest):
                 detail=f"Failed to execute generated SQL query: {sql_query}"
             )
         
-        # Serialize results
-        serialized_results = []
-        for row in result["results"]:
-            if hasattr(row, '_mapping'):
-                serialized_results.append(dict(row._mapping))
-            elif hasattr(row, '_asdict'):
-                serialized_results.append(row._asdict())
-            else:
-                serialized_results.append(dict(row))
-        
-        return ExecutionResponse(
-            results=serialized_results,
-            row_count=len(serialized_results),
-            optimization_suggestion=result["optimization_suggestion"]
+        return _build_execution_response(
+            result, sql_query, llm_config, background_tasks, with_optimization, as_arrow, include_sql=True
         )
     
     except ValueError as e:
@@ -273,6 +500,14 @@ def optimize_query(request: SQLExecuteRequest):
         logger.error(f"Error getting optimization suggestions: {e}")
         raise HTTPException(status_code=500, detail=f"Optimization analysis failed: {str(e)}")
 
+@app.get("/api/optimize/{token}")
+def get_optimization(token: str):
+    """Return deferred optimization suggestions for an /api/execute suggestion token."""
+    suggestion = get_suggestion(token)
+    if suggestion is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired suggestion token.")
+    return suggestion
+
 # System information endpoints
 @app.get("/api/llm/info")
 def llm_info():
@@ -290,7 +525,7 @@ def llm_info():
 
 @app.get("/api/health")
 def health():
-    """Health check for API availability."""
+    """Liveness check for API availability; makes no external calls."""
     try:
         return {
             "status": "ok",
@@ -299,10 +534,14 @@ def health():
             "requires_runtime_config": True,
             "endpoints": {
                 "generate": "/api/generate",
+                "generate_stream": "/api/generate/stream",
+                "generate_batch": "/api/generate/batch",
                 "execute": "/api/execute",
                 "validate": "/api/validate",
                 "explain": "/api/explain",
                 "optimize": "/api/optimize",
+                "invalidate_schema": "/api/schema/invalidate",
+                "ready": "/api/ready",
                 "generate_and_execute": "/api/generate-and-execute"
             }
         }
@@ -313,6 +552,19 @@ def health():
             "error": str(e)
         }
 
+@app.get("/api/ready")
+def ready():
+    """Readiness check based on the most recent background database probe."""
+    status_code = 200 if _readiness["database"] else 503
+    return JSONResponse(
+        status_code=status_code,
+        content={
+            "status": "ready" if status_code == 200 else "not_ready",
+            "database": _readiness["database"],
+            "checked_at": _readiness["checked_at"]
+        }
+    )
+
 @app.get("/")
 def root():
     """Root endpoint with API information."""
@@ -346,7 +598,14 @@ async def general_exception_handler(request, exc):
         }
     )
 
-# Uncomment to run directly
-# if __name__ == "__main__":
-#     import uvicorn
-#     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+# Run directly with one worker process per WEB_CONCURRENCY
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="uvloop",
+        http="httptools"
+    )
@@ -1,8 +1,10 @@
 from multiprocessing import context
 import os
+import re
 import logging
+from itertools import groupby
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam
 from urllib.parse import quote_plus
 
 
@@ -18,6 +20,17 @@ MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
 MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
 MYSQL_PORT = os.getenv("MYSQL_PORT", "3306")  
 
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Statement logging is expensive; only enable it for debugging
+SQL_ECHO = os.getenv("SQL_ECHO") == "1"
+
+
+# Allowlist for database and table names accepted from API requests
+IDENTIFIER_RE = re.compile(r"[A-Za-z0-9_]+")
+
 
 # Encode the password for the URL
 encoded_password = quote_plus(MYSQL_PASSWORD)
@@ -27,13 +40,18 @@ encoded_password = quote_plus(MYSQL_PASSWORD)
 DATABASE_URL = f"mysql+mysqlconnector://{MYSQL_USER}:{encoded_password}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
 
 
-print(f"Connected to database: {DATABASE_URL}")
-
 # Create the SQLAlchemy engine
 try:
     logging.debug(f"Connecting to database at {MYSQL_HOST}:{MYSQL_PORT} as user {MYSQL_USER}")
     logging.debug(f"Using database: {MYSQL_DATABASE}")
-    engine = create_engine(DATABASE_URL, echo=True)
+    engine = create_engine(
+        DATABASE_URL,
+        echo=SQL_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
     logging.info("Database engine created successfully.")
 except Exception as e:
     logging.error(f"Error creating database engine: {e}")
@@ -49,30 +67,77 @@ def list_databases():
         logging.error(f"Error fetching databases: {e}")
         return {"error": str(e)}
 
-# Function to get the current table names
+# Function to validate a database or table name
+def is_valid_identifier(name):
+    return bool(name) and IDENTIFIER_RE.fullmatch(name) is not None
+
+# Function to get the current table names (defaults to the connection's database)
 def get_table_names(database=None):
+    query = text(
+        "SELECT table_name FROM information_schema.TABLES "
+        "WHERE table_schema = COALESCE(:db, DATABASE()) "
+        "ORDER BY table_name"
+    )
     try:
         with engine.connect() as connection:
-            result = connection.execute(text(f"SHOW TABLES FROM {database};")).fetchall()
-            return {"tables": [row[0] for row in result]}
+            return {"tables": connection.execute(query, {"db": database}).scalars().all()}
     except Exception as e:
         logging.error(f"Error fetching table names: {e}")
         return {"error": str(e)}
     
 # Function to LIST ALL columns in a table
 def get_columns(table_name, database=None):
+    query = text(
+        "SELECT column_name FROM information_schema.COLUMNS "
+        "WHERE table_schema = COALESCE(:db, DATABASE()) AND table_name = :table "
+        "ORDER BY ordinal_position"
+    )
     try:
         with engine.connect() as connection:
-            result = connection.execute(text(f"SHOW COLUMNS FROM `{table_name}` FROM `{database}`;")).fetchall()
-            return {"columns": [row[0] for row in result]}
+            return {"columns": connection.execute(query, {"db": database, "table": table_name}).scalars().all()}
     except Exception as e:
         logging.error(f"Error fetching columns for table {table_name}: {e}")
         return {"error": str(e)}    
 
+# Function to fetch tables and columns for several databases in one round-trip
+# (databases=None means every database except those in excluded)
+def get_schema_bulk(databases=None, excluded=()):
+    if databases is not None and not databases:
+        return {"schema": {}}
+    if databases is not None:
+        where, params = "table_schema IN :dbs", {"dbs": list(databases)}
+    elif excluded:
+        where, params = "table_schema NOT IN :dbs", {"dbs": list(excluded)}
+    else:
+        where, params = "1 = 1", {}
+    query = text(
+        "SELECT table_schema, table_name, column_name "
+        "FROM information_schema.COLUMNS "
+        f"WHERE {where} "
+        "ORDER BY table_schema, table_name, ordinal_position"
+    )
+    if params:
+        query = query.bindparams(bindparam("dbs", expanding=True))
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        schema = {db: {} for db in databases or []}
+        for (db, table), columns in groupby(rows, key=lambda row: (row[0], row[1])):
+            schema.setdefault(db, {})[table] = [row[2] for row in columns]
+        return {"schema": schema}
+    except Exception as e:
+        logging.error(f"Error fetching schema for databases {databases}: {e}")
+        return {"error": str(e)}
 
-
-
-
+# Function to check that the database answers a trivial query
+def ping_database():
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logging.error(f"Database ping failed: {e}")
+        return False
 
 # Function to test connection
 def test_connection():
@@ -2,9 +2,12 @@ module.exports = {
 	apps : [{
 		name: 'ai-sql-backend-fastapi',
 		script: 'uvicorn',
-		args: 'app:app --host 0.0.0.0 --port 8080',
+		args: 'app:app --host 0.0.0.0 --port 8080 --loop uvloop --http httptools',
 		interpreter: 'python3',
 		cwd: '/home/yash/ai-with-sql/ai-sql',
+		env: {
+			WEB_CONCURRENCY: 4,
+		},
 	},{
 		name: 'ai-sql-frontend-streamlit',
 		script: 'streamlit',
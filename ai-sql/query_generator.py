@@ -1,82 +1,492 @@
 import os
-import sqlparse
 import re
+import json
+import logging
+import string
+import time
+import uuid
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+import httpx
+import pyarrow as pa
+import sqlparse
+from sqlparse.tokens import Comment
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from groq import Groq
 from openai import OpenAI
 from dotenv import load_dotenv
+import semantic_cache
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from database import engine, list_databases, get_table_names, get_columns
+from database import engine, get_schema_bulk
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Limit to avoid excessive token usage (66k token overhead issue)
 MAX_TABLES = 15
 MAX_COLUMN_PER_TABLE = 30
 SUPPORTED_PROVIDERS = {"openai", "groq", "gemini", "anthropic"}
+# SQL statement keywords used to locate the query inside an LLM response
+_STATEMENT_KEYWORDS = ("select", "with", "insert", "update", "delete", "create")
+# A WITH that opens a common table expression rather than a sentence ("With the schema ...")
+_WITH_CLAUSE_RE = re.compile(r"with\s+(?:recursive\b|(?:\w+|`[^`]*`)\s*(?:\([^()]*\)\s*)?as\s*\()")
+# Length-preserving ASCII lowercasing, so offsets in the lowered copy match the original text
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+# Characters that can open a quoted token or comment; see _sql_span
+_SPAN_STARTS = frozenset("'\"`#-/")
+# Statement keywords a query must start with to be sent to the database
+_EXECUTABLE_RE = re.compile(
+    r"\(*\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP|TRUNCATE|"
+    r"SHOW|DESCRIBE|DESC|EXPLAIN|SET|USE|CALL)\b",
+    re.IGNORECASE
+)
+# validate_sql_query messages for problems reported by _scan_sql
+_SCAN_ERRORS = {
+    "quote": "Unterminated string or quoted identifier.",
+    "comment": "Unterminated /* comment.",
+    "paren": "Unbalanced parentheses: missing ')'.",
+    "close_paren": "Unbalanced parentheses: unexpected ')'.",
+}
+# Statements MySQL can EXPLAIN; index suggestions are skipped for everything else
+_EXPLAINABLE_RE = re.compile(r"\(*\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+NOT_APPLICABLE_SUGGESTION = "N/A for this statement type"
+# Row-returning statements that can safely be paginated with a trailing LIMIT
+_ROW_QUERY_RE = re.compile(r"^\s*\(*\s*(SELECT|WITH)\b", re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+# Top-level clauses a trailing LIMIT can't follow: locking reads and SELECT ... INTO
+_UNPAGEABLE_RE = re.compile(r"\b(INTO|FOR\s+UPDATE|FOR\s+SHARE|LOCK\s+IN\s+SHARE\s+MODE)\b", re.IGNORECASE)
+# A WITH clause leading into DML, matched on _blank_sql(nested=True) text; "REPLACE(" is a function call
+_WITH_DML_RE = re.compile(
+    r"\s*\(*\s*WITH\b(?:[^()]*\([^()]*\))+\s*(INSERT|UPDATE|DELETE|REPLACE)\b(?!\s*\()", re.IGNORECASE
+)
+# Default page size for executed queries so huge result sets are never fully materialized
+DEFAULT_RESULT_LIMIT = 1000
+# Rows converted per Arrow record batch, so only one partition of row tuples is alive at a time
+ARROW_BATCH_ROWS = 1000
+# Exclude massive system databases that balloon the token size
+SYSTEM_DATABASES = {'information_schema', 'mysql', 'performance_schema', 'sys'}
+# Standard boilerplate columns filtered out to save tokens
+IGNORED_COLUMNS = {'created_at', 'updated_at', 'deleted_at', 'created_by', 'updated_by'}
+# Introspected schemas are reused for this many seconds before re-reading them
+SCHEMA_TTL_SECS = int(os.getenv("SCHEMA_TTL_SECS", "300"))
+
+# Process-local LRU cache for LLM responses; only low-temperature calls are cached
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+_llm_cache = OrderedDict()
+_schema_cache = {}
+_schema_cache_version = 0
+# With Redis, a shared counter carries /api/schema/invalidate to every worker; each worker
+# re-reads it at most every SCHEMA_VERSION_POLL_SECS
+SCHEMA_VERSION_KEY = "schema:version"
+SCHEMA_VERSION_POLL_SECS = 2
+_shared_schema_version = (float("-inf"), None)
+_cache_lock = threading.Lock()
+
+# Optional Redis backend that shares cached LLM responses across uvicorn workers
+REDIS_URL = os.getenv("REDIS_URL")
+LLM_CACHE_TTL_SECS = int(os.getenv("LLM_CACHE_TTL_SECS", "604800"))
+# Bump when prompts or response post-processing change so older shared entries are ignored
+PROMPT_VERSION = "1"
+# After a Redis error it is skipped for this long, so an outage doesn't add timeouts to every call
+REDIS_RETRY_SECS = 30
+_redis_client = None
+_redis_retry_at = 0.0
+
+# Provider SDK clients are reused per API key and share one keep-alive HTTP/2 pool,
+# so consecutive requests skip DNS and TLS handshakes
+LLM_CLIENT_CACHE_SIZE = 64
+_llm_clients = OrderedDict()
+_http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128, keepalive_expiry=60),
+    timeout=httpx.Timeout(45.0, connect=5.0)
+)
+# Upper bound on provider calls in flight per worker; further calls wait for a slot
+# instead of piling more blocked threads and sockets onto the provider
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+# Anthropic and Gemini are called over plain HTTPS; a session keeps those connections alive too
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_maxsize=LLM_MAX_CONCURRENCY))
+
+# Batched generation fans out to the provider concurrently; its server-side batching coalesces the requests
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="sql-batch")
+
+# Runs EXPLAIN alongside the query on the inline optimization path
+_explain_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="explain")
+
+# Optimization suggestions computed after /api/execute has returned are kept in Redis under a token,
+# so whichever worker serves the follow-up request can read them
+SUGGESTION_TOKEN_TTL_SECS = 3600
+SUGGESTION_CACHE_SIZE = 1024
+# Finished suggestions keyed by schema version, provider, model, API key hash and SQL digest, so repeated queries skip EXPLAIN and the LLM;
+# entries expire with the schema TTL since a worker may miss another worker's refresh
+_suggestion_cache = OrderedDict()
+# Keywords uppercased by _sql_digest; identifiers keep their case since MySQL table names can be case-sensitive
+_DIGEST_KEYWORDS = frozenset((
+    "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "IS", "NULL", "AS", "ON", "USING",
+    "JOIN", "LEFT", "RIGHT", "INNER", "OUTER", "CROSS", "STRAIGHT_JOIN", "GROUP", "BY", "ORDER",
+    "HAVING", "LIMIT", "OFFSET", "UNION", "ALL", "DISTINCT", "INSERT", "INTO", "VALUES", "UPDATE",
+    "SET", "DELETE", "REPLACE", "WITH", "RECURSIVE", "CASE", "WHEN", "THEN", "ELSE", "END", "ASC",
+    "DESC", "LIKE", "BETWEEN", "EXISTS", "COUNT", "SUM", "AVG", "MIN", "MAX",
+))
+
+
+def _is_dash_comment(sql, i):
+    """Return True if a '--' comment starts at i; MySQL requires whitespace (or the end) after it."""
+    return sql.startswith("--", i) and (i + 2 == len(sql) or sql[i + 2].isspace())
+
+def _sql_span(sql, i):
+    """Return (kind, end) for a quoted token or comment starting at sql[i], or (None, i).
+
+    kind is "quote", "line_comment", "comment" or "hint" (/*! */ and /*+ */); end is the
+    offset just past the span, or -1 when a quote or block comment is unterminated.
+    A line comment ends at its newline, which is left for the caller.
+    """
+    ch = sql[i]
+    length = len(sql)
+    if ch in ("'", '"', "`"):
+        j = i + 1
+        while j < length and sql[j] != ch:
+            j += 2 if sql[j] == "\\" and ch != "`" else 1
+        return "quote", (j + 1 if j < length else -1)
+    if ch == "#" or (ch == "-" and _is_dash_comment(sql, i)):
+        newline = sql.find("\n", i)
+        return "line_comment", (length if newline == -1 else newline)
+    if ch == "/" and sql.startswith("/*", i):
+        comment_end = sql.find("*/", i + 2)
+        kind = "hint" if sql.startswith(("/*!", "/*+"), i) else "comment"
+        return kind, (-1 if comment_end == -1 else comment_end + 2)
+    return None, i
+
+def _scan_sql(sql, start=0):
+    """Scan sql for the first ';' outside quotes, comments and parentheses.
+
+    Returns (end, problem): end is the ';' index or -1, and problem names what was left
+    unbalanced before that point ("quote", "comment", "paren" or "close_paren"), or None.
+    """
+    depth = 0
+    problem = None
+    i = start
+    length = len(sql)
+
+    while i < length:
+        ch = sql[i]
+        if ch in _SPAN_STARTS:
+            kind, span_end = _sql_span(sql, i)
+            if kind:
+                if span_end == -1:
+                    return -1, "quote" if kind == "quote" else "comment"
+                i = span_end
+                continue
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            if depth == 0:
+                problem = problem or "close_paren"
+            else:
+                depth -= 1
+        elif ch == ";" and depth == 0:
+            return i, problem
+        i += 1
+
+    return -1, problem or ("paren" if depth else None)
+
+def _skip_leading_comments(sql, start=0):
+    """Return the offset of the first character that is neither whitespace nor part of a comment."""
+    i = start
+    length = len(sql)
+    while i < length:
+        if sql[i].isspace():
+            i += 1
+            continue
+        kind, span_end = _sql_span(sql, i)
+        if kind in (None, "quote") or span_end == -1:
+            break
+        i = span_end
+    return i
+
+def _find_statement_end(sql, start=0):
+    """Return the index of the first ';' outside quotes, comments and parentheses, or -1."""
+    return _scan_sql(sql, start)[0]
+
+def _strip_fence(text):
+    """Return the body of the first markdown code fence (to the end if unclosed), or text unchanged."""
+    fence = text.find("```")
+    if fence == -1:
+        return text
+
+    body_start = fence + 3
+    newline = text.find("\n", body_start)
+    line_end = newline if newline != -1 else len(text)
+    # Skip an info string such as "sql" on the opening fence line
+    info = text[body_start:line_end].strip()
+    if not info or info.isalnum():
+        body_start = line_end + 1 if newline != -1 else line_end
+
+    close = text.find("```", body_start)
+    return text[body_start:close] if close != -1 else text[body_start:]
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == "_"
+
+def _keyword_candidates(lower):
+    """Return offsets of whole-word statement keywords in lowered text.
+
+    Keywords that start a line come first, so prose such as "query to select users" is
+    tried last; each group is in text order.
+    """
+    line_start = []
+    inline = []
+    for keyword in _STATEMENT_KEYWORDS:
+        pos = lower.find(keyword)
+        while pos != -1:
+            after = pos + len(keyword)
+            if (pos == 0 or not _is_word_char(lower[pos - 1])) and \
+                    (after == len(lower) or not _is_word_char(lower[after])) and \
+                    (keyword != "with" or _WITH_CLAUSE_RE.match(lower, pos)):
+                # Only spaces or tabs may precede a line-start keyword
+                i = pos
+                while i > 0 and lower[i - 1] in " \t":
+                    i -= 1
+                (line_start if i == 0 or lower[i - 1] == "\n" else inline).append(pos)
+            pos = lower.find(keyword, pos + 1)
+    return sorted(line_start) + sorted(inline)
 
+def _locate_statement(text):
+    """Return (start, end) of the first SQL statement in fence-free text.
+
+    start is None when no statement keyword is found; end is -1 while the statement is unterminated.
+    A candidate that runs into an unterminated quote (such as the apostrophe in "here's")
+    or never reaches a ';' gives way to the next one that does.
+    """
+    lower = text.translate(_ASCII_LOWER)
+    candidates = _keyword_candidates(lower)
+    fallback = None
+    for start in candidates:
+        end, problem = _scan_sql(text, start)
+        if end != -1:
+            return start, end
+        if fallback is None and problem != "quote":
+            fallback = start
+    if fallback is None:
+        fallback = candidates[0] if candidates else None
+    return fallback, -1
+
+def _extract_sql(text):
+    """Extract the first SQL statement from an LLM response."""
+    body = _strip_fence(text)
+    start, end = _locate_statement(body)
+    if start is None:
+        return body.strip()
+    return body[start:end + 1] if end != -1 else body[start:].strip()
 
 def clean_sql_output(sql):
     """Remove markdown formatting and extract the raw SQL query."""
+    return _extract_sql(sql)
 
-    # Remove markdown code block formatting
-    clean_query = re.sub(r"```sql\n(.*?)\n```", r"\1", sql, flags=re.DOTALL)
-    clean_query = re.sub(r"```\n(.*?)\n```", r"\1", clean_query, flags=re.DOTALL)
+def _until_statement_end(deltas):
+    """Pass streamed text deltas through, stopping once a complete SQL statement has arrived."""
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        yield delta
+        if ";" in delta and _locate_statement(_strip_fence(buffer))[1] != -1:
+            break
 
-    # Extract only valid SQL (handle AI explanations)
-    sql_match = re.search(r"SELECT .*?;", clean_query, re.DOTALL | re.IGNORECASE)
+def _load_schema(database=None):
+    """Fetch every table and its columns in one round-trip; returns (schema, complete)."""
+    if database:
+        schema_data = get_schema_bulk([database])
+    else:
+        schema_data = get_schema_bulk(excluded=SYSTEM_DATABASES)
+    complete = "error" not in schema_data
 
-    return sql_match.group(0) if sql_match else clean_query.strip()
+    schema = {
+        db: {
+            table: [c for c in columns if c.lower() not in IGNORED_COLUMNS][:MAX_COLUMN_PER_TABLE]
+            for table, columns in tables.items()
+        }
+        for db, tables in schema_data.get("schema", {}).items()
+    }
+    return schema, complete
 
-def get_limited_schema(database=None, nl_query=None):
-    """Get a limited schema prioritizing query-relevant tables."""
-    schema = {}
-    databases = [database] if database else list_databases().get("databases", [])
-    
-    # Exclude massive system databases that balloon the token size
-    system_dbs = {'information_schema', 'mysql', 'performance_schema', 'sys'}
-    databases = [db for db in databases if db not in system_dbs]
+def _get_cached_schema(database=None):
+    """Return the cached schema entry for a database, reloading it once the TTL expires.
+
+    The entry holds the schema dict plus each table's prompt line, formatted once per load,
+    the full prompt text when every table fits within MAX_TABLES, and a fingerprint of the lines.
+    """
+    now = time.monotonic()
+    version = _schema_version()
+    with _cache_lock:
+        cached = _schema_cache.get(database)
+    if cached and cached[1] == version and now - cached[0] < SCHEMA_TTL_SECS:
+        return cached[2]
+
+    schema, complete = _load_schema(database)
+    lines = {}
+    for db, tables in schema.items():
+        # A selected database is named once in the prompt, so its tables need no prefix
+        prefix = "" if database else f"{db}."
+        for table, columns in tables.items():
+            lines[(db, table)] = f"{prefix}{table}({','.join(columns)})"
+    entry = {
+        "schema": schema,
+        "lines": lines,
+        # Small schemas are sent whole, so the text is the same for every prompt
+        "full_text": "\n".join(lines.values()) if len(lines) <= MAX_TABLES else None,
+        # Scopes semantic cache entries, so SQL written for an older schema is never reused
+        "fingerprint": hashlib.blake2b("\n".join(lines.values()).encode("utf-8"), digest_size=8).hexdigest()
+    }
+    # Don't pin partial results from a failed introspection for a full TTL
+    if complete:
+        with _cache_lock:
+            _schema_cache[database] = (now, version, entry)
+    return entry
 
-    total_tables_added = 0
+def _schema_version():
+    """Return this worker's schema version, combined with the shared Redis one when configured."""
+    global _shared_schema_version
+    now = time.monotonic()
+    checked_at, shared = _shared_schema_version
+    if REDIS_URL and now - checked_at >= SCHEMA_VERSION_POLL_SECS:
+        # On a Redis error the last known value is kept, so an outage doesn't flush caches
+        try:
+            client = _get_redis()
+            if client is not None:
+                value = client.get(SCHEMA_VERSION_KEY)
+                shared = value.decode("utf-8") if value is not None else "0"
+        except Exception as e:
+            _redis_failed("Schema version read", e)
+        _shared_schema_version = (now, shared)
+    return f"{_schema_cache_version}:{shared or 0}"
 
-    for db in databases:
-        if total_tables_added >= MAX_TABLES:
+def refresh_schema():
+    """Drop cached schemas and bump the schema version after DDL changes.
+
+    The next request re-reads the schema, and index suggestions computed against the
+    old schema are dropped. Returns True when the bump was shared through Redis and so
+    reaches every worker, False when only this worker was refreshed.
+    """
+    global _schema_cache_version, _shared_schema_version
+    with _cache_lock:
+        _schema_cache.clear()
+        _suggestion_cache.clear()
+        _schema_cache_version += 1
+
+    try:
+        client = _get_redis()
+        if client is None:
+            return False
+        client.incr(SCHEMA_VERSION_KEY)
+    except Exception as e:
+        _redis_failed("Schema version bump", e)
+        return False
+    _shared_schema_version = (float("-inf"), None)
+    return True
+
+def _select_tables(schema, nl_query=None):
+    """Return up to MAX_TABLES (db, table) pairs, prioritizing query-relevant tables."""
+    selected = []
+    query_lower = nl_query.lower() if nl_query else None
+
+    for db, db_tables in schema.items():
+        if len(selected) >= MAX_TABLES:
             break
-            
-        schema[db] = {}
-        tables = get_table_names(db).get("tables", [])
-        
-        if nl_query:
-            query_lower = nl_query.lower()
+
+        tables = list(db_tables)
+        remaining = MAX_TABLES - len(selected)
+        if query_lower and len(tables) > remaining:
             # Prioritize tables whose exact name or space-replaced name appears in query
             matched = [t for t in tables if t.lower() in query_lower or t.replace('_', ' ').lower() in query_lower]
-            unmatched = [t for t in tables if t not in matched]
-            tables = matched + unmatched
+            matched_set = set(matched)
+            unmatched = [t for t in tables if t not in matched_set]
+            chosen = set((matched + unmatched)[:remaining])
+            # Keep schema order so requests choosing the same tables produce the same prompt prefix
+            tables = [t for t in tables if t in chosen]
 
-        for table in tables:
-            if total_tables_added >= MAX_TABLES:
-                break
-                
-            columns = get_columns(table, db).get("columns", [])
-            # Filter out standard boilerplate columns to save tokens
-            ignored_cols = {'created_at', 'updated_at', 'deleted_at', 'created_by', 'updated_by'}
-            columns = [c for c in columns if c.lower() not in ignored_cols][:MAX_COLUMN_PER_TABLE]
-            
-            schema[db][table] = columns
-            total_tables_added += 1
+        selected.extend((db, table) for table in tables[:remaining])
+
+    return selected
 
+def get_limited_schema(database=None, nl_query=None):
+    """Get a limited schema prioritizing query-relevant tables."""
+    full_schema = _get_cached_schema(database)["schema"]
+    schema = {}
+    for db, table in _select_tables(full_schema, nl_query):
+        schema.setdefault(db, {})[table] = full_schema[db][table]
     return schema
 
+def get_schema_text(database=None, nl_query=None):
+    """Get the prompt-ready schema text for the tables get_limited_schema would select."""
+    entry = _get_cached_schema(database)
+    if entry["full_text"] is not None:
+        return entry["full_text"]
+    lines = entry["lines"]
+    return "\n".join([lines[key] for key in _select_tables(entry["schema"], nl_query)])
+
+# Enhanced prompt for better SQL generation
+SQL_SYSTEM_PROMPT = (
+    "You write optimized MySQL queries. Reply with one valid SQL statement ending in a semicolon "
+    "and no explanation."
+)
+
+# Sampling settings for SQL generation: greedy decoding, a hard output cap, and stop sequences
+# that end decoding at a blank line after the statement or its closing fence
+SQL_MAX_TOKENS = int(os.getenv("SQL_MAX_TOKENS", "256"))
+SQL_GENERATION_OPTIONS = {
+    "temperature": 0,
+    "max_tokens": SQL_MAX_TOKENS,
+    "top_p": 1,
+    "stop": [";\n\n", "```\n\n"]
+}
+
+def _cache_get(cache, key):
+    """Return a cached value (or None) and mark it as most recently used."""
+    with _cache_lock:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
+
+def _cache_set(cache, key, value, max_entries):
+    """Store a value in an LRU cache, evicting the oldest entries past max_entries."""
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+
 def validate_sql_query(sql):
     """Validate the SQL query syntax before execution."""
-    try:
-        parsed = sqlparse.parse(sql)
-        if not parsed:
-           return False, "Invalid SQL syntax."
-        return True, None
-    except Exception as e:
-        return False, str(e)
+    stripped = (sql or "").strip()
+    if not stripped:
+        return False, "Empty SQL query."
+    if not _EXECUTABLE_RE.match(stripped, _skip_leading_comments(stripped)):
+        return False, "Query does not start with a SQL statement keyword."
+
+    end, problem = _scan_sql(stripped)
+    if problem:
+        return False, _SCAN_ERRORS[problem]
+    # Text after the first ';' may be a trailing comment or a second statement; let sqlparse decide
+    if end != -1 and stripped[end + 1:].strip() and _count_statements(stripped) > 1:
+        return False, "Multiple SQL statements are not supported."
+    return True, None
+
+def _count_statements(sql):
+    """Count statements with content other than whitespace and comments."""
+    return sum(
+        1 for statement in sqlparse.parse(sql)
+        if any(not token.is_whitespace and token.ttype not in Comment for token in statement.flatten())
+    )
 
 def _require_llm_config(llm_config):
     """Validate runtime LLM configuration sent from UI."""
@@ -93,64 +503,201 @@ def _require_llm_config(llm_config):
     if provider not in SUPPORTED_PROVIDERS:
         raise ValueError(f"Unsupported provider '{provider}'. Supported providers: OpenAI, Groq, Gemini, Anthropic.")
 
-    return {
+    cfg = {
         "provider": provider,
         "model": model,
         "api_key": api_key
     }
+    # Optional draft model for providers that support server-side speculative decoding
+    speculative_model = (llm_config.get("speculative_model") or "").strip()
+    if speculative_model:
+        cfg["speculative_model"] = speculative_model
+    return cfg
+
+def _get_redis():
+    """Return the shared Redis client, or None when REDIS_URL is not configured or Redis is backing off."""
+    global _redis_client
+    if time.monotonic() < _redis_retry_at:
+        return None
+    if _redis_client is None and REDIS_URL:
+        import redis
+        _redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis_client
+
+def _redis_failed(action, error):
+    """Log a Redis error and skip Redis for REDIS_RETRY_SECS."""
+    global _redis_retry_at
+    _redis_retry_at = time.monotonic() + REDIS_RETRY_SECS
+    logger.warning(f"{action} failed, skipping Redis for {REDIS_RETRY_SECS}s: {error}")
+
+def _shared_cache_get(key):
+    """Read a cached LLM response from Redis; cache outages are treated as misses."""
+    try:
+        client = _get_redis()
+        value = client.get(key) if client else None
+        return value.decode("utf-8") if value is not None else None
+    except Exception as e:
+        _redis_failed("Shared cache read", e)
+        return None
+
+def _shared_cache_set(key, value):
+    """Write an LLM response to Redis with LLM_CACHE_TTL_SECS expiry."""
+    try:
+        client = _get_redis()
+        if client:
+            client.set(key, value, ex=LLM_CACHE_TTL_SECS)
+    except Exception as e:
+        _redis_failed("Shared cache write", e)
+
+def _get_sdk_client(provider, api_key):
+    """Return a cached Groq/OpenAI client for this API key."""
+    key = (provider, api_key)
+    client = _cache_get(_llm_clients, key)
+    if client is None:
+        client_cls = Groq if provider == "groq" else OpenAI
+        client = client_cls(api_key=api_key, http_client=_http_client)
+        _cache_set(_llm_clients, key, client, LLM_CLIENT_CACHE_SIZE)
+    return client
+
+def _api_key_digest(cfg):
+    """Return a short hash of the caller's API key, so cached answers are only served to the same key."""
+    return hashlib.blake2b(cfg["api_key"].encode("utf-8"), digest_size=8).hexdigest()
+
+def _llm_cache_key(cfg, system_prompt, user_prompt, temperature, max_tokens, top_p, stop=None):
+    """Return the response cache key, or None when sampling is too random to reuse answers."""
+    if temperature > LLM_CACHE_MAX_TEMPERATURE:
+        return None
+    return "llm:" + PROMPT_VERSION + ":" + hashlib.sha256("|".join([
+        cfg["provider"], cfg["model"], _api_key_digest(cfg), str(temperature), str(max_tokens), str(top_p),
+        repr(stop), system_prompt, user_prompt
+    ]).encode("utf-8")).hexdigest()
 
-def _call_llm(system_prompt, user_prompt, llm_config, temperature=0.2, max_tokens=512, top_p=0.95):
-    """Call the configured LLM provider and return plain text."""
+def _llm_cache_lookup(cache_key):
+    cached = _cache_get(_llm_cache, cache_key)
+    if cached is not None:
+        return cached
+    cached = _shared_cache_get(cache_key)
+    if cached is not None:
+        _cache_set(_llm_cache, cache_key, cached, LLM_CACHE_MAX_ENTRIES)
+    return cached
+
+def _llm_cache_store(cache_key, content):
+    _cache_set(_llm_cache, cache_key, content, LLM_CACHE_MAX_ENTRIES)
+    _shared_cache_set(cache_key, content)
+
+def _call_llm(system_prompt, user_prompt, llm_config, temperature=0.2, max_tokens=512, top_p=0.95, stop=None,
+              stop_at_statement_end=False):
+    """Call the configured LLM provider and return plain text, serving repeats from cache.
+
+    With stop_at_statement_end=True the response is streamed and reading stops at the
+    first complete SQL statement.
+    """
     cfg = _require_llm_config(llm_config)
-    provider = cfg["provider"]
-    model = cfg["model"]
-    api_key = cfg["api_key"]
 
-    if provider == "groq":
-        client = Groq(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p
-        )
-        return response.choices[0].message.content.strip()
+    cache_key = _llm_cache_key(cfg, system_prompt, user_prompt, temperature, max_tokens, top_p, stop)
+    if cache_key:
+        cached = _llm_cache_lookup(cache_key)
+        if cached is not None:
+            return cached
+
+    with _llm_slots:
+        if stop_at_statement_end:
+            deltas = _stream_provider(system_prompt, user_prompt, cfg, temperature, max_tokens, top_p, stop)
+            # Closing the stream early stops paying for tokens after the statement's ';'
+            try:
+                content = "".join(_until_statement_end(deltas)).strip()
+            finally:
+                deltas.close()
+        else:
+            content = _call_provider(system_prompt, user_prompt, cfg, temperature, max_tokens, top_p, stop)
+    if cache_key and content:
+        _llm_cache_store(cache_key, content)
+    return content
+
+def _sse_events(response):
+    """Yield the JSON payload of each server-sent event in a streaming requests response."""
+    # SSE is UTF-8 by spec, but servers rarely declare a charset
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data:"):
+            data = line[5:].strip()
+            if data and data != "[DONE]":
+                yield json.loads(data)
+
+def _gemini_text(payload):
+    candidates = payload.get("candidates", [])
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "\n".join([p.get("text", "") for p in parts if p.get("text")])
 
-    if provider == "openai":
-        client = OpenAI(api_key=api_key)
+def _chat_messages(system_prompt, user_prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _speculative_body(cfg):
+    """Return extra_body for OpenAI-compatible SDK calls when a draft model is configured."""
+    if cfg.get("speculative_model"):
+        return {"speculative_model": cfg["speculative_model"]}
+    return None
+
+def _anthropic_request(system_prompt, user_prompt, cfg, temperature, max_tokens, stop=None):
+    """Return (url, headers, payload) for an Anthropic messages request."""
+    headers = {
+        "x-api-key": cfg["api_key"],
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json"
+    }
+    payload = {
+        "model": cfg["model"],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        # Anthropic only reuses prompt prefixes marked cacheable; short system prompts are simply not cached
+        "system": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
+        "messages": [{"role": "user", "content": user_prompt}]
+    }
+    if stop:
+        payload["stop_sequences"] = stop
+    return "https://api.anthropic.com/v1/messages", headers, payload
+
+def _gemini_request(system_prompt, user_prompt, cfg, temperature, max_tokens, stop=None, stream=False):
+    """Return (url, headers, payload) for a Gemini generateContent request."""
+    combined_prompt = f"System instructions:\n{system_prompt}\n\nUser request:\n{user_prompt}"
+    method = "streamGenerateContent?alt=sse&" if stream else "generateContent?"
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{cfg['model']}:{method}key={cfg['api_key']}"
+    payload = {
+        "contents": [{"parts": [{"text": combined_prompt}]}],
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens
+        }
+    }
+    if stop:
+        payload["generationConfig"]["stopSequences"] = stop
+    return url, {"content-type": "application/json"}, payload
+
+def _call_provider(system_prompt, user_prompt, cfg, temperature, max_tokens, top_p, stop=None):
+    """Send a single chat request to the validated provider config."""
+    provider = cfg["provider"]
+
+    if provider in ("groq", "openai"):
+        client = _get_sdk_client(provider, cfg["api_key"])
         response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            model=cfg["model"],
+            messages=_chat_messages(system_prompt, user_prompt),
             temperature=temperature,
             max_tokens=max_tokens,
-            top_p=top_p
+            top_p=top_p,
+            stop=stop,
+            extra_body=_speculative_body(cfg)
         )
         return response.choices[0].message.content.strip()
 
     if provider == "anthropic":
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json"
-            },
-            json={
-                "model": model,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "system": system_prompt,
-                "messages": [{"role": "user", "content": user_prompt}]
-            },
-            timeout=45
-        )
+        url, headers, payload = _anthropic_request(system_prompt, user_prompt, cfg, temperature, max_tokens, stop)
+        response = _http_session.post(url, headers=headers, json=payload, timeout=45)
         response.raise_for_status()
         payload = response.json()
         parts = payload.get("content", [])
@@ -158,70 +705,114 @@ def _call_llm(system_prompt, user_prompt, llm_config, temperature=0.2, max_token
         return "\n".join([t for t in text_parts if t]).strip()
 
     if provider == "gemini":
-        combined_prompt = f"System instructions:\n{system_prompt}\n\nUser request:\n{user_prompt}"
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}",
-            headers={"content-type": "application/json"},
-            json={
-                "contents": [{"parts": [{"text": combined_prompt}]}],
-                "generationConfig": {
-                    "temperature": temperature,
-                    "maxOutputTokens": max_tokens
-                }
-            },
-            timeout=45
-        )
+        url, headers, payload = _gemini_request(system_prompt, user_prompt, cfg, temperature, max_tokens, stop)
+        response = _http_session.post(url, headers=headers, json=payload, timeout=45)
         response.raise_for_status()
-        payload = response.json()
-        candidates = payload.get("candidates", [])
-        if not candidates:
-            return ""
-        parts = candidates[0].get("content", {}).get("parts", [])
-        return "\n".join([p.get("text", "") for p in parts if p.get("text")]).strip()
+        return _gemini_text(response.json()).strip()
 
     raise ValueError(f"Unsupported provider '{provider}'.")
 
-def generate_sql_query(nl_query, database=None, llm_config=None):
-    """Convert natural language query to an optimized SQL query."""
-    schema = get_limited_schema(database, nl_query)
+def _stream_provider(system_prompt, user_prompt, cfg, temperature, max_tokens, top_p, stop=None):
+    """Yield text deltas from a streamed chat request; closing the generator closes the stream."""
+    provider = cfg["provider"]
 
-    schema_text = "\n".join([f"{db}.{table}: {', '.join(columns)}" for db, tables in schema.items() for table, columns in tables.items()])
+    if provider in ("groq", "openai"):
+        client = _get_sdk_client(provider, cfg["api_key"])
+        response = client.chat.completions.create(
+            model=cfg["model"],
+            messages=_chat_messages(system_prompt, user_prompt),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=stop,
+            stream=True,
+            extra_body=_speculative_body(cfg)
+        )
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        finally:
+            response.close()
+        return
 
-    # Enhanced prompt for better SQL generation
-    system_prompt = """You are an expert SQL query generator specialized in creating optimized, production-ready SQL queries. 
-    
-    Guidelines:
-    - Generate only valid, executable SQL
-    - Use proper indexing strategies
-    - Prefer JOINs over subqueries when possible
-    - Use appropriate aggregate functions and GROUP BY
-    - Include proper WHERE clause filtering
-    - Return only the SQL query without explanations
-    - End queries with semicolon"""
+    if provider == "anthropic":
+        url, headers, payload = _anthropic_request(system_prompt, user_prompt, cfg, temperature, max_tokens, stop)
+        payload["stream"] = True
+        with _http_session.post(url, headers=headers, json=payload, timeout=45, stream=True) as response:
+            response.raise_for_status()
+            for event in _sse_events(response):
+                if event.get("type") == "content_block_delta":
+                    yield event["delta"].get("text", "")
+        return
+
+    if provider == "gemini":
+        url, headers, payload = _gemini_request(system_prompt, user_prompt, cfg, temperature, max_tokens, stop, stream=True)
+        with _http_session.post(url, headers=headers, json=payload, timeout=45, stream=True) as response:
+            response.raise_for_status()
+            for event in _sse_events(response):
+                yield _gemini_text(event)
+        return
+
+    raise ValueError(f"Unsupported provider '{provider}'.")
+
+def _semantic_lookup(nl_query, database, cfg):
+    """Return (scope, embedding, cached_sql); scope is None when the semantic cache is off or failed."""
+    if not semantic_cache.is_enabled():
+        return None, None, None
+    try:
+        fingerprint = _get_cached_schema(database)["fingerprint"]
+        scope = f"{cfg['provider']}|{cfg['model']}|{_api_key_digest(cfg)}|{database or ''}|{fingerprint}"
+        embedding = semantic_cache.embed(nl_query)
+        return scope, embedding, semantic_cache.lookup(scope, embedding)
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed: {e}")
+        return None, None, None
+
+def _sql_prompts(nl_query, database):
+    """Return (system_prompt, user_prompt) for SQL generation.
+
+    Instructions and schema go in the system message and only the request in the user
+    message, so providers that cache prompt prefixes can reuse everything before it.
+    """
+    schema_text = get_schema_text(database, nl_query)
+
+    if database:
+        schema_text = f"Database {database} (prefix table names with {database}.):\n{schema_text}"
 
-    user_prompt = f"""Database Schema:
-{schema_text}
+    system_prompt = f"""{SQL_SYSTEM_PROMPT}
 
-Convert this natural language request to an optimized SQL query:
-{nl_query}
+Schema as table(columns):
+{schema_text}"""
+    return system_prompt, nl_query
 
-Return only the SQL query:"""
+def _finish_sql(raw_sql_query, nl_query, semantic_scope, embedding):
+    """Clean raw LLM output and remember it in the semantic cache."""
+    clean_sql = clean_sql_output(raw_sql_query)
+    if not clean_sql:
+        raise RuntimeError("LLM returned an empty response. Check provider, model, and API key.")
+    if semantic_scope:
+        semantic_cache.store(semantic_scope, nl_query, embedding, clean_sql)
+    return clean_sql
+
+def generate_sql_query(nl_query, database=None, llm_config=None):
+    """Convert natural language query to an optimized SQL query."""
+    cfg = _require_llm_config(llm_config)
+    semantic_scope, embedding, cached_sql = _semantic_lookup(nl_query, database, cfg)
+    if cached_sql:
+        return cached_sql
+
+    system_prompt, user_prompt = _sql_prompts(nl_query, database)
 
     try:
         raw_sql_query = _call_llm(
             system_prompt=system_prompt,
             user_prompt=user_prompt,
-            llm_config=llm_config,
-            temperature=0.1,  # Low temperature for more consistent SQL generation
-            max_tokens=1024,
-            top_p=0.95
+            llm_config=cfg,
+            stop_at_statement_end=True,
+            **SQL_GENERATION_OPTIONS
         )
-
-        # Clean the response to extract the SQL query
-        clean_sql = clean_sql_output(raw_sql_query)
-        if not clean_sql:
-            raise RuntimeError("LLM returned an empty response. Check provider, model, and API key.")
-        return clean_sql
+        return _finish_sql(raw_sql_query, nl_query, semantic_scope, embedding)
     
     except ValueError:
         raise
@@ -230,28 +821,168 @@ Return only the SQL query:"""
     except Exception as e:
         raise RuntimeError(f"LLM request failed: {str(e)}")
 
-def suggest_index(sql, llm_config=None):
-    """Suggest indexes for the given SQL query."""
-    
+def stream_sql_query(nl_query, database=None, llm_config=None):
+    """Validate the LLM config, then return a generator of SQL generation events.
+
+    The generator yields ("delta", text) as tokens arrive and finishes with ("done", clean_sql),
+    or ("error", message) if generation fails part-way.
+    """
+    cfg = _require_llm_config(llm_config)
+    return _stream_sql_events(nl_query, database, cfg)
+
+def _stream_sql_events(nl_query, database, cfg):
     try:
-        with engine.connect() as connection:
-            explain_query = f"EXPLAIN {sql}"
-            result = connection.execute(text(explain_query))
-            execution_plan = result.fetchall()
+        semantic_scope, embedding, cached_sql = _semantic_lookup(nl_query, database, cfg)
+        if cached_sql:
+            yield "delta", cached_sql
+            yield "done", cached_sql
+            return
+
+        system_prompt, user_prompt = _sql_prompts(nl_query, database)
+        cache_key = _llm_cache_key(cfg, system_prompt, user_prompt, **SQL_GENERATION_OPTIONS)
+        raw_sql_query = _llm_cache_lookup(cache_key) if cache_key else None
+        if raw_sql_query is not None:
+            yield "delta", raw_sql_query
+        else:
+            parts = []
+            with _llm_slots:
+                deltas = _stream_provider(system_prompt, user_prompt, cfg, **SQL_GENERATION_OPTIONS)
+                try:
+                    for delta in _until_statement_end(deltas):
+                        parts.append(delta)
+                        yield "delta", delta
+                finally:
+                    deltas.close()
+            raw_sql_query = "".join(parts).strip()
+            if cache_key and raw_sql_query:
+                _llm_cache_store(cache_key, raw_sql_query)
+
+        yield "done", _finish_sql(raw_sql_query, nl_query, semantic_scope, embedding)
+    except Exception as e:
+        yield "error", str(e) if isinstance(e, (ValueError, RuntimeError)) else f"LLM request failed: {e}"
+
+def generate_sql_queries(nl_queries, database=None, llm_config=None):
+    """Convert several natural language queries concurrently.
+
+    Returns a list of {"sql_query", "error"} dicts in input order; one failed query doesn't fail the batch.
+    """
+    _require_llm_config(llm_config)
+    # Load the schema once up front so workers don't all miss the cache together
+    _get_cached_schema(database)
+
+    def generate_one(nl_query):
+        try:
+            return {"sql_query": generate_sql_query(nl_query, database, llm_config), "error": None}
+        except (ValueError, RuntimeError) as e:
+            return {"sql_query": None, "error": str(e)}
+
+    return list(_batch_executor.map(generate_one, nl_queries))
+
+def supports_index_suggestions(sql):
+    """Return True for statements MySQL can EXPLAIN (SELECT and DML)."""
+    sql = sql or ""
+    return bool(_EXPLAINABLE_RE.match(sql, _skip_leading_comments(sql)))
+
+def _sql_digest(sql):
+    """Normalize SQL for cache keys: drop comments, collapse whitespace and uppercase keywords.
+
+    Literals, identifiers and optimizer hints (/*! */, /*+ */) are kept verbatim.
+    """
+    out = []
+    pending_space = False
+    i = 0
+    length = len(sql)
+
+    while i < length:
+        ch = sql[i]
+        kind, span_end = _sql_span(sql, i) if ch in _SPAN_STARTS else (None, i)
+        span_end = length if span_end == -1 else span_end
+        if kind in ("line_comment", "comment"):
+            i = span_end
+            pending_space = True
+            continue
+        elif kind:
+            token = sql[i:span_end]
+            i = span_end
+        elif ch.isspace():
+            pending_space = True
+            i += 1
+            continue
+        elif _is_word_char(ch):
+            j = i + 1
+            while j < length and _is_word_char(sql[j]):
+                j += 1
+            token = sql[i:j]
+            if token.upper() in _DIGEST_KEYWORDS:
+                token = token.upper()
+            i = j
+        else:
+            token = ch
+            i += 1
+
+        if pending_space and out:
+            out.append(" ")
+        pending_space = False
+        out.append(token)
+
+    digest = "".join(out)
+    return digest[:-1].rstrip() if digest.endswith(";") else digest
+
+def _suggestion_cache_key(sql, cfg):
+    scope = f"{_schema_version()}|{cfg['provider']}|{cfg['model']}|{_api_key_digest(cfg)}"
+    return hashlib.blake2b(f"{scope}|{_sql_digest(sql)}".encode("utf-8"), digest_size=8).hexdigest()
+
+def _cached_suggestion(cache_key):
+    """Return a cached index suggestion younger than SCHEMA_TTL_SECS, or None."""
+    cached = _cache_get(_suggestion_cache, cache_key)
+    if cached is None or time.monotonic() - cached[0] >= SCHEMA_TTL_SECS:
+        return None
+    return cached[1]
+
+def _explain(sql):
+    """Run EXPLAIN for sql on its own pooled connection and return the plan rows."""
+    with engine.connect() as connection:
+        execution_plan = connection.execute(text(f"EXPLAIN {sql}")).fetchall()
 
-        print("\nExecution Plan:")
-        for row in execution_plan:
-            print(row)
+    # Formatting every plan row is wasted work unless debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Execution plan:\n" + "\n".join(str(row) for row in execution_plan))
 
+    return execution_plan
+
+def suggest_index(sql, llm_config=None, execution_plan=None):
+    """Suggest indexes for the given SQL query.
+
+    Pass execution_plan when the caller already ran EXPLAIN; otherwise it is run here.
+    """
+    if not supports_index_suggestions(sql):
+        return NOT_APPLICABLE_SUGGESTION
+
+    cfg = _require_llm_config(llm_config)
+    cache_key = _suggestion_cache_key(sql, cfg)
+    cached = _cached_suggestion(cache_key)
+    if cached is not None:
+        return cached
+    
+    if execution_plan is None:
+        try:
+            execution_plan = _explain(sql)
+        except Exception as e:
+            return f"Could not generate execution plan: {e}"
+
+    try:
         # Enhanced index suggestion using selected provider
-        return generate_index_suggestions(sql, execution_plan, llm_config)
+        suggestion = _request_index_suggestions(sql, execution_plan, cfg)
     except ValueError:
         raise
     except Exception as e:
-        return f"Could not generate execution plan: {e}"
+        return f"Could not generate index suggestions: {e}"
 
-def generate_index_suggestions(sql, execution_plan=None, llm_config=None):
-    """Generate index suggestions using configured LLM based on the SQL query."""
+    _cache_set(_suggestion_cache, cache_key, (time.monotonic(), suggestion), SUGGESTION_CACHE_SIZE)
+    return suggestion
+
+def _request_index_suggestions(sql, execution_plan, llm_config):
+    """Ask the configured LLM for index suggestions; errors propagate to the caller."""
     
     system_prompt = """You are a database optimization expert. Analyze SQL queries and suggest appropriate indexes to improve performance.
     
@@ -272,42 +1003,225 @@ Execution Plan:
 
 Suggest specific indexes to improve this query's performance. Return only the index suggestions:"""
 
+    return _call_llm(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        llm_config=llm_config,
+        temperature=0.2,
+        max_tokens=512
+    )
+
+def generate_index_suggestions(sql, execution_plan=None, llm_config=None):
+    """Generate index suggestions using configured LLM based on the SQL query."""
     try:
-        return _call_llm(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            llm_config=llm_config,
-            temperature=0.2,
-            max_tokens=512
-        )
+        return _request_index_suggestions(sql, execution_plan, llm_config)
     except ValueError:
         raise
     except Exception as e:
         return f"Could not generate index suggestions: {e}"
     
-def execution_query(sql, llm_config=None):
-    """Execute a validated and optimized SQL query."""
+def _store_suggestion(token, suggestion):
+    """Write a token's suggestion status to Redis; returns False when Redis is unavailable."""
+    try:
+        client = _get_redis()
+        if client is None:
+            return False
+        client.set(f"suggestion:{token}", json.dumps(suggestion), ex=SUGGESTION_TOKEN_TTL_SECS)
+        return True
+    except Exception as e:
+        _redis_failed("Suggestion token write", e)
+        return False
+
+def create_suggestion_token():
+    """Register a pending optimization suggestion and return its token.
+
+    Returns None without a reachable Redis; callers then fetch suggestions through
+    suggest_index, whose results are cached by SQL digest.
+    """
+    token = uuid.uuid4().hex
+    return token if _store_suggestion(token, {"status": "pending"}) else None
+
+def compute_suggestion(token, sql, llm_config=None):
+    """Run suggest_index for a queued token and store the outcome."""
+    try:
+        suggestion = suggest_index(sql, llm_config)
+    except Exception as e:
+        suggestion = f"Could not generate index suggestions: {e}"
+    _store_suggestion(token, {"status": "ready", "optimization_suggestions": suggestion})
+
+def get_suggestion(token):
+    """Return the stored suggestion status for a token, or None if unknown or expired."""
+    try:
+        client = _get_redis()
+        value = client.get(f"suggestion:{token}") if client is not None else None
+    except Exception as e:
+        _redis_failed("Suggestion token read", e)
+        return None
+    return json.loads(value) if value is not None else None
+
+def _blank_sql(sql, nested=False):
+    """Return sql with quoted text and comments replaced by spaces, keeping offsets.
+
+    With nested=True everything inside parentheses is blanked too, leaving only the
+    top-level clauses.
+    """
+    out = []
+    depth = 0
+    i = 0
+    length = len(sql)
+
+    while i < length:
+        ch = sql[i]
+        if ch in _SPAN_STARTS:
+            kind, span_end = _sql_span(sql, i)
+            if kind:
+                span_end = length if span_end == -1 else span_end
+                out.append(" " * (span_end - i))
+                i = span_end
+                continue
+        if ch == "(":
+            depth += 1
+            out.append(" " if nested and depth > 1 else ch)
+        elif ch == ")" and depth:
+            depth -= 1
+            out.append(" " if nested and depth else ch)
+        else:
+            out.append(" " if nested and depth else ch)
+        i += 1
+    return "".join(out)
+
+def _paginate_sql(sql, limit, offset=0):
+    """Append LIMIT/OFFSET to a SELECT, fetching one extra row to detect more.
+
+    Only a LIMIT at the top level counts; one inside a subquery, literal or comment doesn't
+    bound the result. A query with its own LIMIT is left alone on the first page and
+    wrapped in a derived table for later ones. Raises ValueError when offset is given
+    for a statement that can't be paginated.
+    """
+    # Cut at the statement's ';' so a trailing comment can't turn the clause into a second statement
+    end = _find_statement_end(sql)
+    statement = (sql[:end] if end != -1 else sql).rstrip()
+    top_level = _blank_sql(statement, nested=True) if _ROW_QUERY_RE.match(_blank_sql(statement)) else None
+    if top_level is None or _UNPAGEABLE_RE.search(top_level) or _WITH_DML_RE.match(top_level):
+        if offset:
+            raise ValueError("offset is only supported for SELECT queries without INTO or locking clauses.")
+        return sql
+
+    # New lines so a trailing "-- comment" can't swallow the clause
+    page = f"LIMIT {int(limit) + 1} OFFSET {int(offset)}"
+    if not _LIMIT_RE.search(top_level):
+        return f"{statement}\n{page}"
+    if not offset:
+        return sql
+    return f"SELECT * FROM (\n{statement}\n) AS _page\n{page}"
+
+def _rows_to_arrow(columns, rows):
+    """Build an Arrow table column by column from result row tuples."""
+    arrays = []
+    for values in (zip(*rows) if rows else [()] * len(columns)):
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed-type columns (e.g. from UNION or JSON) fall back to their string form
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+def _concat_arrow(tables):
+    """Concatenate per-partition tables, promoting differing column types where Arrow can.
+
+    Permissive promotion widens DECIMAL precision, int64 to double and all-NULL partitions;
+    only columns whose types cannot be unified fall back to string.
+    """
+    if len(tables) == 1:
+        return tables[0]
+    try:
+        return pa.concat_tables(tables, promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+
+    for i, name in enumerate(tables[0].column_names):
+        types = {table.schema.field(i).type for table in tables}
+        try:
+            pa.unify_schemas([pa.schema([pa.field(name, t)]) for t in types], promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            tables = [table.set_column(i, name, table.column(i).cast(pa.string())) for table in tables]
+    return pa.concat_tables(tables, promote_options="permissive")
+
+def _fetch_arrow(result, max_rows):
+    """Read up to max_rows into an Arrow table one partition at a time; returns (table, rows_read)."""
+    if not result.returns_rows:
+        return _rows_to_arrow([], []), 0
+
+    columns = list(result.keys())
+    chunks = []
+    row_count = 0
+    for partition in result.partitions(ARROW_BATCH_ROWS):
+        partition = partition[:max_rows - row_count]
+        chunks.append(_rows_to_arrow(columns, partition))
+        row_count += len(partition)
+        if row_count >= max_rows:
+            break
+
+    if not chunks:
+        return _rows_to_arrow(columns, []), 0
+    return _concat_arrow(chunks), row_count
+
+def execution_query(sql, llm_config=None, with_optimization=True, limit=DEFAULT_RESULT_LIMIT, offset=0, as_arrow=False):
+    """Execute a validated and optimized SQL query.
+
+    At most limit rows (starting at offset) are returned; has_more reports whether the
+    query produced further rows. With with_optimization=False the EXPLAIN + LLM index
+    suggestion step is skipped and optimization_suggestion is None; callers can fetch
+    it later via compute_suggestion. With as_arrow=True results is a pyarrow.Table
+    instead of a list of dicts.
+    """
     
     is_valid, error = validate_sql_query(sql)
     if not is_valid:
-        print(f"Invalid SQL query: {error}")
+        logger.error(f"Invalid SQL query: {error}")
         return None
+    paged_sql = _paginate_sql(sql, limit, offset)
     
+    needs_plan = with_optimization and supports_index_suggestions(sql) and \
+        _cached_suggestion(_suggestion_cache_key(sql, _require_llm_config(llm_config))) is None
+    execution_plan = None
+    index_suggestion = None
+    # EXPLAIN runs on a second pooled connection while the query itself executes
+    plan_future = _explain_executor.submit(_explain, sql) if needs_plan else None
+
     try:
-        # Open a separate connection for query execution
         with engine.connect() as connection:
-            result = connection.execute(text(sql))
-            fetched_results = result.fetchall()
+            result = connection.execute(
+                text(paged_sql),
+                # Drivers with server-side cursors stream rows instead of buffering the whole result
+                execution_options={"stream_results": True} if as_arrow else {}
+            )
+            if as_arrow:
+                fetched_results, row_count = _fetch_arrow(result, limit + 1)
+            else:
+                # Statements such as UPDATE or SET return no rows to fetch
+                fetched_results = result.mappings().fetchmany(limit + 1) if result.returns_rows else []
+                row_count = len(fetched_results)
+        has_more = row_count > limit
+        fetched_results = fetched_results.slice(0, limit) if as_arrow else fetched_results[:limit]
+
+        if plan_future is not None:
+            try:
+                execution_plan = plan_future.result()
+            except SQLAlchemyError as e:
+                index_suggestion = f"Could not generate execution plan: {e}"
 
-        # Open a new connection for query optimization (avoid "command out of sync" error)
-        index_suggestion = suggest_index(sql, llm_config)
+        # The LLM call runs after both connections are back in the pool
+        if with_optimization and index_suggestion is None:
+            index_suggestion = suggest_index(sql, llm_config, execution_plan)
 
         return {
             "results": fetched_results,
+            "has_more": has_more,
             "optimization_suggestion": index_suggestion
         }
     except SQLAlchemyError as e:
-        print(f"Error executing SQL query: {e}")
+        logger.error(f"Error executing SQL query: {e}")
         return None
 
 def explain_query(sql, llm_config=None):
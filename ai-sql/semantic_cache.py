@@ -0,0 +1,175 @@
+import os
+import sqlite3
+import logging
+import threading
+import numpy as np
+from contextlib import closing
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity required to reuse SQL from an earlier prompt; 0 disables the cache
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+# Optional quantized ONNX export of the model; its directory must also contain tokenizer.json
+SEMANTIC_CACHE_ONNX_PATH = os.getenv("SEMANTIC_CACHE_ONNX_PATH")
+# Identifies the embedding space; entries from another model or backend are never compared
+_EMBEDDING_ID = SEMANTIC_CACHE_ONNX_PATH or SEMANTIC_CACHE_MODEL
+# Token limit for the ONNX tokenizer (all-MiniLM-L6-v2 was trained on 256 tokens)
+_MAX_SEQ_LENGTH = 256
+# Optional SQLite file so cached prompts survive restarts
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH")
+# Embedding buffers grow in fixed chunks to avoid reallocating on every insert
+_CHUNK_ROWS = 1024
+
+_model = None
+_onnx = None
+_loaded = False
+_lock = threading.Lock()
+_model_lock = threading.Lock()
+# "embedding id|dim|scope" -> {"matrix": float32 (capacity, dim), "size": int, "sql": [str]}
+_scopes = {}
+
+
+def is_enabled():
+    """Return True when a similarity threshold has been configured."""
+    return SEMANTIC_CACHE_THRESHOLD > 0
+
+def _get_model():
+    """Load the sentence-transformers model on first use."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+            logger.info(f"Loading semantic cache model: {SEMANTIC_CACHE_MODEL}")
+            _model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+    return _model
+
+def _get_onnx():
+    """Load the ONNX session and Rust tokenizer on first use."""
+    global _onnx
+    with _model_lock:
+        if _onnx is None:
+            import onnxruntime
+            from tokenizers import Tokenizer
+            logger.info(f"Loading ONNX semantic cache model: {SEMANTIC_CACHE_ONNX_PATH}")
+            session = onnxruntime.InferenceSession(SEMANTIC_CACHE_ONNX_PATH, providers=["CPUExecutionProvider"])
+            tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(SEMANTIC_CACHE_ONNX_PATH), "tokenizer.json"))
+            tokenizer.enable_truncation(_MAX_SEQ_LENGTH)
+            input_names = {i.name for i in session.get_inputs()}
+            _onnx = (session, tokenizer, input_names)
+    return _onnx
+
+def _embed_onnx(text):
+    session, tokenizer, input_names = _get_onnx()
+    encoding = tokenizer.encode(text)
+    input_ids = np.array([encoding.ids], dtype=np.int64)
+    attention_mask = np.array([encoding.attention_mask], dtype=np.int64)
+    inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "token_type_ids" in input_names:
+        inputs["token_type_ids"] = np.zeros_like(input_ids)
+
+    # Mean-pool token embeddings over the attention mask, as sentence-transformers does
+    hidden = session.run(None, inputs)[0][0]
+    mask = attention_mask[0][:, None].astype(np.float32)
+    vector = (hidden * mask).sum(axis=0) / max(mask.sum(), 1.0)
+    return (vector / max(np.linalg.norm(vector), 1e-12)).astype(np.float32)
+
+def embed(text):
+    """Return the L2-normalized float32 embedding for a prompt."""
+    if SEMANTIC_CACHE_ONNX_PATH:
+        return _embed_onnx(text)
+    vector = _get_model().encode([text], normalize_embeddings=True, convert_to_numpy=True)[0]
+    return vector.astype(np.float32)
+
+def warm_up():
+    """Load the embedding model and persisted entries so the first request doesn't pay for it."""
+    if not is_enabled():
+        return
+    embed("warm up")
+    with _lock:
+        _ensure_loaded()
+
+def _embedding_scope(scope, embedding):
+    """Qualify a caller's scope with the embedding model and dimension."""
+    return f"{_EMBEDDING_ID}|{embedding.shape[0]}|{scope}"
+
+def _append(scope, embedding, sql):
+    """Append an embedding to the in-memory buffers. Caller must hold _lock."""
+    entry = _scopes.get(scope)
+    if entry is None:
+        entry = {"matrix": np.empty((_CHUNK_ROWS, embedding.shape[0]), dtype=np.float32), "size": 0, "sql": []}
+        _scopes[scope] = entry
+    elif entry["size"] == entry["matrix"].shape[0]:
+        grown = np.empty((entry["size"] + _CHUNK_ROWS, embedding.shape[0]), dtype=np.float32)
+        grown[:entry["size"]] = entry["matrix"]
+        entry["matrix"] = grown
+
+    entry["matrix"][entry["size"]] = embedding
+    entry["size"] += 1
+    entry["sql"].append(sql)
+
+def _connect():
+    connection = sqlite3.connect(SEMANTIC_CACHE_PATH)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS semantic_cache ("
+        "scope TEXT NOT NULL, nl_query TEXT NOT NULL, embedding BLOB NOT NULL, sql TEXT NOT NULL)"
+    )
+    return connection
+
+def _ensure_loaded():
+    """Load persisted entries once. Caller must hold _lock."""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not SEMANTIC_CACHE_PATH:
+        return
+    try:
+        with closing(_connect()) as connection:
+            rows = connection.execute("SELECT scope, embedding, sql FROM semantic_cache").fetchall()
+        loaded = 0
+        for scope, blob, sql in rows:
+            embedding = np.frombuffer(blob, dtype=np.float32)
+            # Rows written by another embedding model (or before scopes carried one) are skipped
+            if not scope.startswith(f"{_EMBEDDING_ID}|{embedding.shape[0]}|"):
+                continue
+            _append(scope, embedding, sql)
+            loaded += 1
+        logger.info(f"Loaded {loaded} of {len(rows)} semantic cache entries from {SEMANTIC_CACHE_PATH}")
+    except Exception as e:
+        logger.error(f"Error loading semantic cache: {e}")
+
+def lookup(scope, embedding):
+    """Return cached SQL for the most similar prompt in scope, or None below the threshold."""
+    scope = _embedding_scope(scope, embedding)
+    with _lock:
+        _ensure_loaded()
+        entry = _scopes.get(scope)
+        if not entry or not entry["size"]:
+            return None
+        sims = entry["matrix"][:entry["size"]] @ embedding
+        best = int(sims.argmax())
+        if sims[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return entry["sql"][best]
+    return None
+
+def store(scope, nl_query, embedding, sql):
+    """Remember the SQL generated for a prompt embedding."""
+    scope = _embedding_scope(scope, embedding)
+    with _lock:
+        _ensure_loaded()
+        _append(scope, embedding, sql)
+
+    if not SEMANTIC_CACHE_PATH:
+        return
+    try:
+        with closing(_connect()) as connection, connection:
+            connection.execute(
+                "INSERT INTO semantic_cache (scope, nl_query, embedding, sql) VALUES (?, ?, ?, ?)",
+                (scope, nl_query, embedding.tobytes(), sql)
+            )
+    except Exception as e:
+        logger.error(f"Error persisting semantic cache entry: {e}")
@@ -1,12 +1,16 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import pyarrow as pa
 import json
 from datetime import datetime
 import time
 
 # Configuration
 API_URL = "http://localhost:8080"  # Update with your FastAPI URL
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
 
 # Set page configuration
 st.set_page_config(
@@ -79,20 +83,52 @@ if 'llm_model' not in st.session_state:
     st.session_state.llm_model = ""
 if 'llm_api_key' not in st.session_state:
     st.session_state.llm_api_key = ""
+if 'llm_speculative_model' not in st.session_state:
+    st.session_state.llm_speculative_model = ""
 if 'nl_query_input_area' not in st.session_state:
     st.session_state.nl_query_input_area = ""
 
 # Helper functions
-def make_api_request(endpoint, method="GET", data=None, timeout=30):
+@st.cache_resource
+def get_api_session():
+    """Shared keep-alive session so back-to-back API calls reuse pooled connections across reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(total=2, backoff_factor=0.1)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+def decode_arrow_results(response):
+    """Turn an Arrow IPC execute response into the same shape as the JSON one"""
+    table = pa.ipc.open_stream(response.content).read_all()
+    metadata = table.schema.metadata or {}
+    return {
+        "results": table.to_pandas(),
+        "row_count": int(response.headers.get("X-Row-Count", table.num_rows)),
+        "has_more": response.headers.get("X-Has-More") == "true",
+        "optimization_suggestion": response.headers.get("X-Optimization-Suggestion"),
+        "suggestion_token": response.headers.get("X-Suggestion-Token"),
+        "sql_query": metadata.get(b"sql_query", b"").decode("utf-8") or None
+    }
+
+def make_api_request(endpoint, method="GET", data=None, timeout=30, accept=None):
     """Make API request with error handling"""
     try:
         url = f"{API_URL}{endpoint}"
+        headers = {"Accept": accept} if accept else None
         if method == "GET":
-            response = requests.get(url, timeout=timeout)
+            response = get_api_session().get(url, timeout=timeout, headers=headers)
         else:
-            response = requests.post(url, json=data, timeout=timeout)
+            response = get_api_session().post(url, json=data, timeout=timeout, headers=headers)
         
         if response.status_code == 200:
+            if response.headers.get("content-type", "").startswith(ARROW_STREAM_MEDIA_TYPE):
+                return decode_arrow_results(response), None
             return response.json(), None
         else:
             return None, f"API Error {response.status_code}: {response.text}"
@@ -103,6 +139,47 @@ def make_api_request(endpoint, method="GET", data=None, timeout=30):
     except Exception as e:
         return None, f"Unexpected error: {str(e)}"
 
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_cached(endpoint):
+    """GET an endpoint, memoized for 60 seconds; errors raise so they are never cached"""
+    data, error = make_api_request(endpoint)
+    # Database failures come back as a 200 with an "error" field
+    if not error and isinstance(data, dict) and data.get("error"):
+        error = data["error"]
+    if error:
+        raise RuntimeError(error)
+    return data
+
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_health_cached():
+    """GET /api/health with a short TTL so the status button reflects outages quickly"""
+    data, error = make_api_request("/api/health")
+    if error:
+        raise RuntimeError(error)
+    return data
+
+def cached_api_request(fetch, *args):
+    """Call a cached fetch helper and return (data, error) like make_api_request"""
+    try:
+        return fetch(*args), None
+    except RuntimeError as e:
+        return None, str(e)
+
+def stream_api_events(endpoint, data, timeout=60):
+    """POST to a server-sent events endpoint and yield (event, data) pairs as they arrive"""
+    url = f"{API_URL}{endpoint}"
+    # The with-block closes the response (and aborts the backend stream) if Streamlit stops this run
+    with get_api_session().post(url, json=data, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"API Error {response.status_code}: {response.text}")
+        response.encoding = "utf-8"
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[5:].strip())
+
 def add_to_history(nl_query, sql_query, success=True):
     """Add query to history"""
     st.session_state.query_history.append({
@@ -124,11 +201,15 @@ def get_runtime_llm_config():
     if not provider or not model or not api_key:
         return None
 
-    return {
+    llm_config = {
         "provider": provider,
         "model": model,
         "api_key": api_key
     }
+    speculative_model = (st.session_state.llm_speculative_model or "").strip()
+    if speculative_model and provider in ("groq", "openai"):
+        llm_config["speculative_model"] = speculative_model
+    return llm_config
 
 def require_llm_config():
     """Enforce runtime LLM configuration before AI calls."""
@@ -149,7 +230,7 @@ with st.container():
     with col2:
         if st.button("🔍 Check API Status", key="health_check"):
             with st.spinner("Checking API health..."):
-                health_data, error = make_api_request("/api/health")
+                health_data, error = cached_api_request(fetch_health_cached)
                 if health_data:
                     if health_data.get("status") == "ok":
                         st.markdown(f'<div class="success-box">✅ API is healthy and ready!</div>', unsafe_allow_html=True)
@@ -205,6 +286,13 @@ with st.expander("🤖 AI Provider Settings", expanded=True):
         key="api_key_input"
     )
 
+    speculative_model = st.text_input(
+        "Speculative Draft Model (optional)",
+        value=st.session_state.llm_speculative_model,
+        placeholder="Smaller model id, if the provider supports speculative decoding",
+        key="speculative_model_input"
+    ) if selected_provider_label in ("Groq", "OpenAI") else ""
+
     save_col, clear_col = st.columns(2)
     with save_col:
         if st.button("💾 Save Session Config"):
@@ -213,6 +301,7 @@ with st.expander("🤖 AI Provider Settings", expanded=True):
             st.session_state.llm_provider = provider_value
             st.session_state.llm_model = model_value
             st.session_state.llm_api_key = entered_api_key.strip()
+            st.session_state.llm_speculative_model = speculative_model.strip()
 
             if get_runtime_llm_config():
                 st.success("AI configuration saved for this session.")
@@ -224,6 +313,7 @@ with st.expander("🤖 AI Provider Settings", expanded=True):
             st.session_state.llm_provider = ""
             st.session_state.llm_model = ""
             st.session_state.llm_api_key = ""
+            st.session_state.llm_speculative_model = ""
             st.success("Session AI configuration removed.")
 
     active_config = get_runtime_llm_config()
@@ -238,7 +328,7 @@ st.sidebar.header("🗄️ Database Explorer")
 # Database listing
 if st.sidebar.button("📋 List All Databases"):
     with st.spinner("Fetching databases..."):
-        db_data, error = make_api_request("/api/databases")
+        db_data, error = cached_api_request(fetch_cached, "/api/databases")
         if db_data:
             databases = db_data.get("databases", [])
             st.sidebar.success(f"Found {len(databases)} database(s)")
@@ -254,7 +344,7 @@ if selected_database:
     # Table listing
     if st.sidebar.button("📊 List Tables"):
         with st.spinner("Fetching tables..."):
-            table_data, error = make_api_request(f"/api/databases/{selected_database}/tables")
+            table_data, error = cached_api_request(fetch_cached, f"/api/databases/{selected_database}/tables")
             if table_data:
                 tables = table_data.get("tables", [])
                 st.sidebar.success(f"Found {len(tables)} table(s)")
@@ -269,7 +359,9 @@ if selected_database:
     if selected_table:
         if st.sidebar.button("🔍 Show Columns"):
             with st.spinner("Fetching columns..."):
-                column_data, error = make_api_request(f"/api/tables/{selected_table}/columns?database={selected_database}")
+                column_data, error = cached_api_request(
+                    fetch_cached, f"/api/tables/{selected_table}/columns?database={selected_database}"
+                )
                 if column_data:
                     columns = column_data.get("columns", [])
                     st.sidebar.success(f"Found {len(columns)} column(s)")
@@ -334,39 +426,66 @@ if st.button("✨ Generate SQL Query", key="generate_btn"):
         if not llm_config:
             st.stop()
 
-        with st.spinner("🤖 AI is crafting your SQL query..."):
-            start_time = time.time()
+        start_time = time.time()
+        
+        request_data = {
+            "nl_query": query_input,
+            "database": selected_database if selected_database else None,
+            "llm_config": llm_config
+        }
+        
+        # Paint the SQL token by token as the backend streams it
+        st.subheader("🔧 Generated SQL Query")
+        sql_placeholder = st.empty()
+        stream_result = {}
+        
+        def sql_tokens():
+            for event, payload in stream_api_events("/api/generate/stream", request_data):
+                if event == "delta":
+                    yield payload.get("text", "")
+                elif event == "done":
+                    stream_result["sql_query"] = payload.get("sql_query", "")
+                elif event == "error":
+                    stream_result["error"] = payload.get("detail", "Unknown error")
+        
+        try:
+            with sql_placeholder.container():
+                st.write_stream(sql_tokens())
+            error = stream_result.get("error")
+            if not error and not stream_result.get("sql_query"):
+                error = "Stream ended before the SQL query was complete."
+        except requests.exceptions.Timeout:
+            error = "Request timeout. Please check if the API server is running."
+        except requests.exceptions.ConnectionError:
+            error = "Connection error. Please check if the API server is running."
+        except Exception as e:
+            error = str(e)
+        
+        if not error:
+            execution_time = time.time() - start_time
+            st.session_state.generated_sql = stream_result["sql_query"]
+            sql_placeholder.code(st.session_state.generated_sql, language='sql')
+            
+            st.markdown(f'<div class="success-box">✅ SQL generated in {execution_time:.2f} seconds!</div>', unsafe_allow_html=True)
             
-            request_data = {
-                "nl_query": query_input,
-                "database": selected_database if selected_database else None,
-                "llm_config": llm_config
-            }
+            # Display explanation
+            with st.spinner("📝 Explaining the query..."):
+                explanation_data, _ = make_api_request("/api/explain", "POST", {
+                    "sql_query": st.session_state.generated_sql,
+                    "llm_config": llm_config
+                })
+            explanation = explanation_data.get("explanation", "") if explanation_data else ""
+            if explanation:
+                st.subheader("📝 Query Explanation")
+                st.markdown(f'<div class="info-box">{explanation}</div>', unsafe_allow_html=True)
             
-            response_data, error = make_api_request("/api/generate", "POST", request_data)
+            # Add to history
+            add_to_history(query_input, st.session_state.generated_sql, True)
             
-            if response_data:
-                execution_time = time.time() - start_time
-                st.session_state.generated_sql = response_data.get("sql_query", "")
-                explanation = response_data.get("explanation", "")
-                
-                st.markdown(f'<div class="success-box">✅ SQL generated in {execution_time:.2f} seconds!</div>', unsafe_allow_html=True)
-                
-                # Display generated SQL
-                st.subheader("🔧 Generated SQL Query")
-                st.code(st.session_state.generated_sql, language='sql')
-                
-                # Display explanation
-                if explanation:
-                    st.subheader("📝 Query Explanation")
-                    st.markdown(f'<div class="info-box">{explanation}</div>', unsafe_allow_html=True)
-                
-                # Add to history
-                add_to_history(query_input, st.session_state.generated_sql, True)
-                
-            else:
-                st.markdown(f'<div class="error-box">❌ Failed to generate SQL: {error}</div>', unsafe_allow_html=True)
-                add_to_history(query_input, "", False)
+        else:
+            sql_placeholder.empty()
+            st.markdown(f'<div class="error-box">❌ Failed to generate SQL: {error}</div>', unsafe_allow_html=True)
+            add_to_history(query_input, "", False)
     else:
         st.warning("⚠️ Please enter a natural language query first.")
 
@@ -387,9 +506,11 @@ if st.session_state.generated_sql:
                     "sql_query": st.session_state.generated_sql,
                     "llm_config": llm_config
                 }
-                result_data, error = make_api_request("/api/execute", "POST", request_data)
+                result_data, error = make_api_request("/api/execute", "POST", request_data, accept=ARROW_STREAM_MEDIA_TYPE)
                 
                 if result_data:
+                    # The API only echoes SQL it generated itself
+                    result_data["sql_query"] = st.session_state.generated_sql
                     st.session_state.last_results = result_data
                     results = result_data.get("results", [])
                     row_count = result_data.get("row_count", 0)
@@ -426,7 +547,7 @@ if st.session_state.generated_sql:
                     "database": selected_database if selected_database else None,
                     "llm_config": llm_config
                 }
-                result_data, error = make_api_request("/api/generate-and-execute", "POST", request_data)
+                result_data, error = make_api_request("/api/generate-and-execute", "POST", request_data, accept=ARROW_STREAM_MEDIA_TYPE)
                 
                 if result_data:
                     st.session_state.last_results = result_data
@@ -445,18 +566,23 @@ if st.session_state.last_results:
     
     st.header("📊 Query Results")
     
-    if results:
+    # Arrow responses arrive as a DataFrame already; JSON ones as a list of dicts
+    df = results if isinstance(results, pd.DataFrame) else pd.DataFrame(results)
+    
+    if not df.empty:
         # Results summary
         col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("Total Rows", row_count)
         with col2:
-            st.metric("Columns", len(results[0].keys()) if results else 0)
+            st.metric("Columns", len(df.columns))
         with col3:
-            st.metric("Data Size", f"{len(str(results))} bytes")
+            st.metric("Data Size", f"{int(df.memory_usage(deep=True).sum())} bytes")
         
+        if st.session_state.last_results.get("has_more"):
+            st.caption(f"Showing the first {row_count} rows; the query returned more.")
+
         # Results table
-        df = pd.DataFrame(results)
         st.dataframe(df, use_container_width=True, height=400)
         
         # Download option
@@ -471,6 +597,32 @@ if st.session_state.last_results:
         st.info("No data returned from the query.")
     
     # Optimization suggestions
+    suggestion_token = st.session_state.last_results.get("suggestion_token")
+    executed_sql = st.session_state.last_results.get("sql_query")
+    if not optimization and (suggestion_token or executed_sql):
+        st.subheader("🚀 Performance Optimization")
+        if st.button("💡 Load Optimization Suggestions", key="load_optimization_btn"):
+            with st.spinner("Fetching optimization suggestions..."):
+                if suggestion_token:
+                    suggestion_data, error = make_api_request(f"/api/optimize/{suggestion_token}")
+                else:
+                    # No background token without Redis; ask whichever worker answers directly
+                    llm_config = require_llm_config()
+                    if not llm_config:
+                        st.stop()
+                    suggestion_data, error = make_api_request(
+                        "/api/optimize", "POST", {"sql_query": executed_sql, "llm_config": llm_config}, timeout=60
+                    )
+                    if suggestion_data:
+                        suggestion_data["status"] = "ready"
+                if suggestion_data and suggestion_data.get("status") == "ready":
+                    optimization = suggestion_data.get("optimization_suggestions", "")
+                    st.session_state.last_results["optimization_suggestion"] = optimization
+                elif suggestion_data:
+                    st.info("Suggestions are still being generated. Please try again in a moment.")
+                else:
+                    st.markdown(f'<div class="error-box">❌ Could not load suggestions: {error}</div>', unsafe_allow_html=True)
+
     if optimization:
         st.subheader("🚀 Performance Optimization")
         st.markdown(f'<div class="info-box"><strong>Suggestions:</strong><br>{optimization}</div>', unsafe_allow_html=True)